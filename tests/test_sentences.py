@@ -0,0 +1,77 @@
+""" Tests for TuneCapsule extensions for StreamSort
+
+Copyright (c) 2021 IdmFoundInHim, under MIT License
+"""
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from tunecapsule import _dbinit, sentences
+
+
+class _Api:
+    auth_manager = None
+
+
+def _album(album_id: str, name: str, track_names: list[str]) -> dict:
+    return {
+        "id": album_id,
+        "name": name,
+        "release_date": "2021-01-01",
+        "artists": [{"name": "Artist", "id": "artist"}],
+        "tracks": {
+            "items": [
+                {
+                    "name": track_name,
+                    "duration_ms": 200_000,
+                    "track_number": number,
+                    "id": f"{album_id}{number}",
+                }
+                for number, track_name in enumerate(track_names, 1)
+            ],
+            "next": None,
+        },
+    }
+
+
+class ClassifyRankTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patch = mock.patch.object(
+            _dbinit,
+            "DB_LOCATION",
+            Path(directory.name, "tunecapsule.db"),
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+        _dbinit.initialize_database()
+        self.db = _dbinit.open_database()
+        self.addCleanup(self.db.close)
+
+    def classify(self, album: dict, classification: str):
+        project = {
+            "objects": [{"id": t["id"]} for t in album["tracks"]["items"]]
+        }
+        with self.db:
+            sentences._classify_store_artist_groups(self.db, [album])
+            sentences._classify_project(
+                _Api(), self.db, project, classification, album
+            )
+
+    def test_rerank_single_of_higher_album(self):
+        single = _album("single", "Single S", ["Song"])
+        self.classify(single, "A")
+        self.classify(_album("album", "Album X", ["Song", "B", "C"]), "B")
+        self.classify(single, "C")
+        self.assertEqual(
+            self.db.execute(
+                "SELECT name, classification FROM ranking"
+            ).fetchall(),
+            [("Album X", "B")],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
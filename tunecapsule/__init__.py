@@ -2,12 +2,27 @@
 
 Copyright (c) 2021 IdmFoundInHim, under MIT License
 """
-# pyright: reportUnsupportedDunderAll=false
-from .sentences import __all__ as sentences__all__
-from .stats import __all__ as stats__all__
+__all__ = [
+    "_sentences_",
+    "ss_classify",
+    "ss_season",
+    "ss_score",
+    "cumulative_artist_score",
+    "snapshot_artist_score",
+]
 
-__all__ = ["_sentences_"] + sentences__all__ + stats__all__
 
-from .sentences import *
+def __getattr__(name: str):
+    # Defers importing spotipy and streamsort until a sentence is needed
+    if name not in __all__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from . import sentences, stats
 
-_sentences_ = {"classify": ss_classify, "season": ss_season, "score": ss_score}
+    for module in (sentences, stats):
+        globals().update({k: getattr(module, k) for k in module.__all__})
+    globals()["_sentences_"] = {
+        "classify": sentences.ss_classify,
+        "season": sentences.ss_season,
+        "score": sentences.ss_score,
+    }
+    return globals()[name]
@@ -2,24 +2,27 @@
 
 Copyright (c) 2021 IdmFoundInHim, under MIT License
 """
-import os
-import sqlite3
 import sys
 
 from ._constants import DB_LOCATION
-from ._dbinit import initialize_database
+from ._dbinit import initialize_database, open_database
+
+# Single-token verbs, looked up directly to keep startup free of argparse
+_VERBS = {"reset": lambda: DB_LOCATION.unlink(missing_ok=True)}
 
 print("To use tunecapsule, run 'python -m streamsort tunecapsule'.")
 print("Initializing Database...")
-if (
-    os.path.exists(DB_LOCATION)
-    and len(sys.argv) > 1
-    and "reset" == sys.argv[1]
-):
-    os.remove(DB_LOCATION)
-try:
-    initialize_database()
-    print("Success!")
-except sqlite3.OperationalError:
+verb = sys.argv[1] if len(sys.argv) > 1 else None
+if verb in _VERBS:
+    _VERBS[verb]()
+database = open_database()
+initialized = database.execute(
+    "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'ranking'"
+).fetchone()
+database.close()
+if initialized:
     print("Database is active, so nothing was done.")
     print("Use 'python -m tunecapsule reset' to wipe the database.")
+else:
+    initialize_database()
+    print("Success!")
@@ -6,17 +6,17 @@ Copyright (c) 2021 IdmFoundInHim, under MIT License
 """
 __all__ = ["DB_DIRECTORY", "DB_LOCATION"]
 
-import os
+from pathlib import Path
 
 DB_DIRECTORY = ""
-DB_LOCATION = os.path.join(DB_DIRECTORY, "tunecapsule.db")
-DB_STRRAY_DELIMITER = "\t"
+DB_LOCATION = Path(DB_DIRECTORY, "tunecapsule.db").resolve()
 SPOTIFY_DATE_DELIMITER = "-"
-SHA256_ENCODING = "u8"
-RANKINGS = ["E", "C", "B", "A"]  # Lowest to Highest
-AUTOSEASON_RANKINGS = {"A", "B"}
-EXCLUSION_CERTIFICATIONS = {"CHRISTMAS"}
+RANKINGS_ORDER = ("E", "C", "B", "A")  # Lowest to Highest
+RANKINGS = frozenset(RANKINGS_ORDER)
+RANKINGS_INDEX = {ranking: i for i, ranking in enumerate(RANKINGS_ORDER)}
+AUTOSEASON_RANKINGS = frozenset({"A", "B"})
+EXCLUSION_CERTIFICATIONS = frozenset({"CHRISTMAS"})
 MAX_AUTOSEASON = 366
 IDEAL_AUTOSEASON_LENGTH = 80
 
-SEASON_KEYWORDS = {"update"}
+SEASON_KEYWORDS = frozenset({"update"})
@@ -2,79 +2,286 @@
 
 Copyright (c) 2021 IdmFoundInHim, under MIT License
 """
-__all__ = ["initialize_database"]
+__all__ = [
+    "CLASSIFICATION_COLUMNS",
+    "initialize_database",
+    "open_database",
+    "shared_database",
+]
 
-import os
+import atexit
+import json
 import sqlite3
+from functools import cache
 
-from ._constants import DB_DIRECTORY, DB_LOCATION
+from ._constants import DB_LOCATION
+from .stats import project_value
+from .utilities import list2strray
 
+# Shared by ranking and certification, in storage order
+CLASSIFICATION_COLUMNS = (
+    ("release_day", "INTEGER"),
+    ("artist_names", "TEXT"),
+    ("name", "TEXT"),
+    ("classification", "TEXT"),
+    ("track_names", "TEXT"),
+    ("track_durations_sec", "TEXT"),
+    ("track_numbers", "TEXT"),
+    ("retrieved_time", "INTEGER"),
+    ("artist_group", "TEXT"),
+    ("album_spotify_id", "TEXT"),
+    ("track_spotify_ids", "TEXT"),
+    ("track_count", "INTEGER"),
+    ("project_value", "REAL"),
+)
+CLASSIFICATION_TABLE_TEMPLATE = ", ".join(
+    f"{name} {sql_type}" for name, sql_type in CLASSIFICATION_COLUMNS
+)
 
-def initialize_database():
-    try:
-        if DB_DIRECTORY:
-            os.makedirs(DB_DIRECTORY, exist_ok=True)
-    except FileExistsError:
-        pass
-    CLASSIFICATION_TABLE_TEMPLATE = """
-        release_day INTEGER,
-        artist_names TEXT,
-        name TEXT,
-        classification TEXT,
-        track_names TEXT,
-        track_durations_sec TEXT,
-        track_numbers TEXT,
-        retrieved_time INTEGER,
-        artist_group TEXT,
-        album_spotify_id TEXT,
-        track_spotify_ids TEXT
-    """
-    with sqlite3.connect(DB_LOCATION) as database:
-        database.executescript(
+
+def _migrate_json_arrays(database: sqlite3.Connection):
+    """Re-encodes arrays stored as tab-delimited text as JSON"""
+    database.create_function(
+        "tabs_to_json", 2, _tabs_to_json, deterministic=True
+    )
+    for table in ("ranking", "certification"):
+        database.execute(
             f"""
-        CREATE TABLE ranking ({CLASSIFICATION_TABLE_TEMPLATE},
-            PRIMARY KEY (release_day, artist_names, name)
-        );
-        CREATE TABLE certification ({CLASSIFICATION_TABLE_TEMPLATE},
-            PRIMARY KEY (release_day, artist_names, name, classification)
-        );
-        CREATE TABLE season (
-            min_year INTEGER,
-            max_year INTEGER,
-            classification TEXT,
-            start_date INTEGER,
-            stop_date INTEGER,
-            playlist_spotify_id TEXT,
-            PRIMARY KEY (min_year, max_year, classification)
-                ON CONFLICT REPLACE
-        );
-        CREATE TABLE helper_artist_group (
-            artist_group TEXT,
-            artist_name TEXT,
-            artist_spotify_id TEXT,
-            PRIMARY KEY (artist_group, artist_spotify_id) ON CONFLICT IGNORE
-        );
-        CREATE TABLE helper_single (
-            single_release_day INTEGER,
-            artist_names TEXT,
-            single_name TEXT,
-            album_release_day INTEGER,
-            album_name TEXT,
-            single_track_names TEXT,
-            album_track_names TEXT,
-            PRIMARY KEY (
-                single_release_day,
-                artist_names,
-                single_name,
-                single_track_names
-            ) ON CONFLICT REPLACE
-        );
-        CREATE TABLE helper_artist_score (
-            artist_group TEXT,
-            date_from INTEGER,
-            score INTEGER,
-            PRIMARY KEY(artist_group, date_from) ON CONFLICT REPLACE
-        );
+            UPDATE {table} SET
+                artist_names = tabs_to_json(artist_names, 0),
+                track_names = tabs_to_json(track_names, 0),
+                track_durations_sec = tabs_to_json(track_durations_sec, 1),
+                track_numbers = tabs_to_json(track_numbers, 1),
+                artist_group = tabs_to_json(artist_group, 0),
+                track_spotify_ids = tabs_to_json(track_spotify_ids, 0)
+            """
+        )
+    # Autoseasons are keyed by their number rather than an array
+    database.execute(
+        """
+        UPDATE season SET classification = tabs_to_json(classification, 0)
+        WHERE classification GLOB '*[^0-9]*'
+        """
+    )
+    database.execute(
         """
+        UPDATE helper_artist_group
+        SET artist_group = tabs_to_json(artist_group, 0)
+        """
+    )
+    database.execute(
+        """
+        UPDATE helper_single SET
+            artist_names = tabs_to_json(artist_names, 0),
+            single_track_names = tabs_to_json(single_track_names, 0),
+            album_track_names = tabs_to_json(album_track_names, 0)
+        """
+    )
+    # Scores are recalculated on every season upload, and a lone artist
+    # cannot be told apart from a group of one in the old format
+    database.execute("DELETE FROM helper_artist_score")
+
+
+def _migrate_track_count(database: sqlite3.Connection):
+    """Adds the track count that autoseasons split on"""
+    for table in ("ranking", "certification"):
+        database.execute(f"ALTER TABLE {table} ADD COLUMN track_count INTEGER")
+        database.execute(
+            f"""
+            UPDATE {table}
+            SET track_count = json_array_length(track_durations_sec)
+            """
         )
-        database.commit()
+
+
+def _migrate_project_value(database: sqlite3.Connection):
+    """Adds the stored project values that scores are totalled from"""
+    # Valued by the same function as newly classified projects
+    database.create_function(
+        "project_value",
+        1,
+        lambda durations: project_value(json.loads(durations)),
+        deterministic=True,
+    )
+    for table in ("ranking", "certification"):
+        database.execute(f"ALTER TABLE {table} ADD COLUMN project_value REAL")
+        database.execute(
+            f"""
+            UPDATE {table}
+            SET project_value = project_value(track_durations_sec)
+            """
+        )
+
+
+def _migrate_indexes(database: sqlite3.Connection):
+    """Adds the indexes that were introduced after the tables"""
+    for index in _INDEXES:
+        database.execute(index)
+
+
+def _tabs_to_json(strray: str | None, numeric: int) -> str | None:
+    if strray is None:
+        return None
+    items = strray.split("\t") if strray else []
+    return list2strray(map(int, items) if numeric else items)
+
+
+_INDEXES = (
+    """
+    CREATE INDEX IF NOT EXISTS idx_ranking_artist
+        ON ranking(artist_group, release_day)
+    """,
+    # Seasons filter on classification and a date range, and compare
+    # track_names against the same classifications to drop singles
+    """
+    CREATE INDEX IF NOT EXISTS idx_ranking_season
+        ON ranking(classification, release_day, track_names)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_certification_season
+        ON certification(classification, release_day, track_names)
+    """,
+    # Scores and single checks start from one artist, not a group
+    """
+    CREATE INDEX IF NOT EXISTS idx_helper_artist_group_artist
+        ON helper_artist_group(artist_spotify_id, artist_group)
+    """,
+)
+
+# Each step upgrades a database from the version at its index, as kept
+# in PRAGMA user_version; new databases start at the latest version
+_MIGRATIONS = (
+    _migrate_json_arrays,
+    _migrate_track_count,
+    _migrate_project_value,
+    _migrate_indexes,
+)
+
+_DDL_SCRIPT = f"""
+BEGIN IMMEDIATE;
+PRAGMA user_version = {len(_MIGRATIONS)};
+CREATE TABLE IF NOT EXISTS ranking ({CLASSIFICATION_TABLE_TEMPLATE},
+    PRIMARY KEY (release_day, artist_names, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS certification ({CLASSIFICATION_TABLE_TEMPLATE},
+    PRIMARY KEY (release_day, artist_names, name, classification)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS season (
+    min_year INTEGER,
+    max_year INTEGER,
+    classification TEXT,
+    start_date INTEGER,
+    stop_date INTEGER,
+    playlist_spotify_id TEXT,
+    PRIMARY KEY (min_year, max_year, classification)
+        ON CONFLICT REPLACE
+);
+-- season keeps its rowid: unbounded seasons store NULL years in
+-- the primary key, which WITHOUT ROWID tables reject
+CREATE TABLE IF NOT EXISTS helper_artist_group (
+    artist_group TEXT,
+    artist_name TEXT,
+    artist_spotify_id TEXT,
+    PRIMARY KEY (artist_group, artist_spotify_id) ON CONFLICT IGNORE
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS helper_single (
+    single_release_day INTEGER,
+    artist_names TEXT,
+    single_name TEXT,
+    album_release_day INTEGER,
+    album_name TEXT,
+    single_track_names TEXT,
+    album_track_names TEXT,
+    PRIMARY KEY (
+        single_release_day,
+        artist_names,
+        single_name,
+        single_track_names
+    ) ON CONFLICT REPLACE
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS helper_artist_score (
+    artist_group TEXT,
+    date_from INTEGER,
+    score INTEGER,
+    PRIMARY KEY(artist_group, date_from) ON CONFLICT REPLACE
+) WITHOUT ROWID;
+{"".join(f"{index};" for index in _INDEXES)}
+COMMIT;
+"""
+
+
+def open_database(isolation_level: str | None = "") -> sqlite3.Connection:
+    """Connects to the TuneCapsule database
+
+    Connections share one SQLite page cache, so later connections start
+    warm with the pages earlier ones have loaded. The cache is enlarged
+    to 16 MiB and reads go through a memory map of up to 256 MiB, while
+    temporary tables and sorts stay in memory. Databases created before
+    WAL was the default are converted, and commits only sync at
+    checkpoints.
+    """
+    # SQLite creates the file, but not the directory holding it
+    DB_LOCATION.parent.mkdir(parents=True, exist_ok=True)
+    database = sqlite3.connect(
+        f"{DB_LOCATION.as_uri()}?cache=shared",
+        uri=True,
+        check_same_thread=False,
+        isolation_level=isolation_level,
+    )
+    database.executescript(
+        """
+        PRAGMA mmap_size=268435456;
+        PRAGMA cache_size=-16384;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA foreign_keys=ON;
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        """
+    )
+    _migrate_database(database)
+    return database
+
+
+def _migrate_database(database: sqlite3.Connection):
+    if database.execute("PRAGMA user_version").fetchone()[0] >= len(
+        _MIGRATIONS
+    ):
+        return
+    with database:
+        database.execute("BEGIN IMMEDIATE")
+        # Read again under the write lock, in case another connection
+        # migrated first; a database without tables is not set up yet
+        (version,) = database.execute("PRAGMA user_version").fetchone()
+        if version >= len(_MIGRATIONS) or not database.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table'"
+            " AND name = 'ranking'"
+        ).fetchone():
+            return
+        for migrate in _MIGRATIONS[version:]:
+            migrate(database)
+        database.execute(f"PRAGMA user_version = {len(_MIGRATIONS)}")
+
+
+@cache
+def shared_database() -> sqlite3.Connection:
+    """Returns one connection kept open for the life of the process
+
+    Sentences run one after another, so they share this connection and
+    its warm cache instead of reconnecting each time. Use it as a
+    context manager so failed work is rolled back, not left pending.
+    At exit, SQLite refreshes planner statistics for whatever changed.
+    """
+    database = open_database()
+    atexit.register(_close_shared_database, database)
+    return database
+
+
+def _close_shared_database(database: sqlite3.Connection):
+    database.execute("PRAGMA optimize")
+    database.close()
+
+
+def initialize_database():
+    with open_database(isolation_level=None) as database:
+        # One transaction, so the schema costs a single sync to disk
+        database.executescript(_DDL_SCRIPT)
@@ -4,14 +4,18 @@ Copyright (c) 2021 IdmFoundInHim, under MIT License
 """
 __all__ = ["ss_classify", "ss_season", "ss_score"]
 
-import calendar
+import re
 import sqlite3 as sql
+from bisect import bisect_left
 from collections.abc import Collection, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
-from itertools import pairwise
-from typing import Sequence, cast
+from functools import lru_cache, partial
+from itertools import islice, pairwise
+from operator import itemgetter
+from typing import NamedTuple, Sequence, cast
 
-from more_itertools import chunked, flatten, only, prepend
+from more_itertools import flatten
 from projects import ss_projects
 from spotipy import Spotify, SpotifyPKCE
 from streamsort import (
@@ -21,7 +25,6 @@ from streamsort import (
     UnsupportedQueryError,
     results_generator,
     ss_new,
-    ss_remove,
     state_only_api,
     str_mob, ss_open,
 )
@@ -29,15 +32,20 @@ from streamsort.types import Mob, Query, State
 
 from ._constants import (
     AUTOSEASON_RANKINGS,
-    DB_LOCATION,
     EXCLUSION_CERTIFICATIONS,
     IDEAL_AUTOSEASON_LENGTH,
     MAX_AUTOSEASON,
     RANKINGS,
+    RANKINGS_INDEX,
     SEASON_KEYWORDS,
     SPOTIFY_DATE_DELIMITER,
 )
-from .stats import store_artist_group_score, overall_artist_score
+from ._dbinit import CLASSIFICATION_COLUMNS, shared_database
+from .stats import (
+    overall_artist_score,
+    project_value,
+    store_artist_group_scores,
+)
 from .utilities import (
     autoseason_name,
     beginning_year,
@@ -50,10 +58,74 @@ from .utilities import (
 
 YearRange = tuple[int | None, int | None]
 SeasonQueryGroup = tuple[int, int] | int | str
-HashDigest = bytes
 NULL_YEAR_RANGE = (None, None)
 
 
+class _SeasonMeta(NamedTuple):
+    min_year: int | None
+    max_year: int | None
+    classification: str | int
+    start_date: date | None
+    stop_date: date | None
+    playlist_spotify_id: str
+
+
+_SEASON_META_COLUMNS = ", ".join(_SeasonMeta._fields)
+
+
+class _ClassifyRow(NamedTuple):
+    """A ranking or certification row, in CLASSIFICATION_COLUMNS order"""
+
+    release_day: date
+    artist_names: str
+    name: str
+    classification: str
+    track_names: list[str]
+    track_durations_sec: list[int]
+    track_numbers: list[int]
+    retrieved_time: datetime
+    artist_group: str
+    album_spotify_id: str
+    track_spotify_ids: list[str]
+    track_count: int
+    project_value: float
+
+
+# Kept small so concurrent album lookups stay under Spotify's rate limit
+_ALBUM_FETCH_WORKERS = 8
+_MONTH_LAST_DAY = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+_SEASON_TOKEN_RE = re.compile(
+    r"(?P<min>\d{4})(?:-(?P<max>\d{2}|\d{4}))?|(?P<num>\d{1,3})",
+    re.ASCII,
+)
+_SEASON_SPLIT_COLUMNS = "ranking.track_count, ranking.release_day"
+_INSERT_RANKING_SQL = (
+    "INSERT OR REPLACE INTO ranking "
+    f"VALUES {sql_array(CLASSIFICATION_COLUMNS)}"
+)
+_INSERT_CERT_SQL = (
+    f"INSERT INTO certification VALUES {sql_array(CLASSIFICATION_COLUMNS)}"
+)
+_INSERT_CERT_OR_IGNORE_SQL = _INSERT_CERT_SQL.replace(
+    "INSERT", "INSERT OR IGNORE", 1
+)
+# Only what decides between re-ranking and skipping is read back
+_SELECT_RANKING_SQL = """
+    SELECT album_spotify_id, classification, track_count
+    FROM ranking
+    WHERE release_day = ? AND artist_names = ? AND name = ?
+"""
+# Only the album and tracks of an existing row are needed to merge
+_SELECT_CERT_SQL = """
+    SELECT album_spotify_id, track_spotify_ids FROM certification
+    WHERE release_day = ? AND artist_names = ? AND name = ?
+        AND classification = ?
+    LIMIT 1
+"""
+_INSERT_ARTIST_SQL = "INSERT INTO helper_artist_group VALUES (?, ?, ?)"
+_INSERT_SINGLE_SQL = "INSERT INTO helper_single VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+
 def ss_classify(subject: State, query: Query) -> State:
     """Associates a project(s) with a classification
 
@@ -73,21 +145,50 @@ def ss_classify(subject: State, query: Query) -> State:
     of each project based on its state in Spotify at runtime and a
     dynamic representation of each project by Spotify URIs.
     """
-    for project in cast(
+    try:
+        classification = cast(str, query).split()[0].upper()
+    except AttributeError as err:
+        raise UnsupportedQueryError(
+            "classify", str_mob(cast(Mob, query))
+        ) from err
+        # raise UnsupportedQueryError("Classification must be text") from err
+    if classification.isnumeric():
+        raise UnsupportedQueryError("classify", cast(str, query))
+        # raise UnsupportedQueryError("Classification cannot be numeric")
+    database = shared_database()
+    projects = cast(
         list[Mob], ss_projects(subject, subject.mob).mob["objects"]
-    ):
-        try:
-            classification = cast(str, query).split()[0].upper()
-        except AttributeError as err:
-            raise UnsupportedQueryError(
-                "classify", str_mob(cast(Mob, query))
-            ) from err
-            # raise UnsupportedQueryError("Classification must be text") from err
-        if classification.isnumeric():
-            raise UnsupportedQueryError("classify", cast(str, query))
-            # raise UnsupportedQueryError("Classification cannot be numeric")
-        with sql.connect(DB_LOCATION) as database:
-            _classify_project(subject.api, database, project, classification)
+    )
+    # Classifying is bound by Spotify requests and SQLite writes rather
+    # than Python computation, so each distinct album is fetched once,
+    # concurrently, and the database work is batched where possible
+    album_uris = [
+        uri
+        for uri in dict.fromkeys(p["root_album"]["uri"] for p in projects)
+        if uri is not None
+    ]
+    with ThreadPoolExecutor(max_workers=_ALBUM_FETCH_WORKERS) as executor:
+        albums = dict(
+            zip(
+                album_uris,
+                executor.map(
+                    partial(_classify_fetch_album, subject.api), album_uris
+                ),
+            )
+        )
+    with database:
+        # One transaction, holding the write lock from the start, so a
+        # failed project leaves nothing half-classified to merge into
+        database.execute("BEGIN IMMEDIATE")
+        _classify_store_artist_groups(database, albums.values())
+        for project in projects:
+            _classify_project(
+                subject.api,
+                database,
+                project,
+                classification,
+                albums.get(project["root_album"]["uri"]),
+            )
     return subject
 
 
@@ -144,81 +245,80 @@ def ss_season(subject: State, query: Query) -> State:
 
     Note that *year* ranges are inclusive-inclusive (r[0] <= n <= r[1]) while *day* ranges are inclusive-exclusive (r[0] <= n < r[1], like the `range` builtin)
     """
-    db = sql.connect(DB_LOCATION)
     if not isinstance(query, str):
         raise UnsupportedQueryError("season", str_mob(query))
-    match list(_season_parse_query(query)):
-        case "update", (year, _year) if year == _year:
-            out = _season_update_year(subject.api, db, year)
-        case "update", (min_year, max_year):
-            out = _season_update_years(subject.api, db, min_year, max_year)
-        case "update",:  # TODO seems broken
-            out = _season_update_years(subject.api, db, *NULL_YEAR_RANGE)
-        case "update", (min_year, max_year), classification if isinstance(
-            classification, int | str
-        ):
-            target = _season_retrieve_metadata(
-                db, (min_year, max_year), classification
-            )
-            out = _season_upload(
-                subject.api,
-                db,
-                list2strray(classification.split()),
-                cast(date, target["start_date"]),
-                cast(date, target["stop_date"]),
-                cast(str, target["playlist_spotify_id"]),
-            )
-        case "update", str(classification):
-            target = _season_retrieve_metadata(
-                db, NULL_YEAR_RANGE, classification
-            )
-            out = _season_upload(
-                subject.api,
-                db,
-                list2strray(classification.split()),
-                None,
-                None,
-                cast(str, target["playlist_spotify_id"]),
-            )
-        case (min_year, max_year), int(season_num):
-            start_date = _season_calculate_start(db, min_year, season_num)
-            end_date = _season_calculate_end(db, start_date, max_year)
-            playlist_id = subject.mob["id"]
-            out = _season_create(
-                subject.api,
-                db,
-                season_num,
-                start_date,
-                end_date,
-                playlist_id,
-            )
-        case (min_year, max_year), str(classification):
-            start_date = beginning_year(min_year)
-            end_date = beginning_year(max_year + 1)
-            playlist_id = subject.mob["id"]
-            out = _season_create(
-                subject.api,
-                db,
-                list2strray(classification.split()),
-                start_date,
-                end_date,
-                playlist_id,
-            )
-        case str(classification),:
-            playlist_id = subject.mob["id"]
-            out = _season_create(
-                subject.api,
-                db,
-                list2strray(classification.split()),
-                None,
-                None,
-                playlist_id,
-            )
-        case _:
-            out = None
-            raise UnsupportedQueryError("season", query)
-    db.commit()
-    db.close()
+    db = shared_database()
+    with db:
+        match _season_parse_query(query):
+            case "update", (year, _year) if year == _year:
+                out = _season_update_year(subject.api, db, year)
+            case "update", (min_year, max_year):
+                out = _season_update_years(subject.api, db, min_year, max_year)
+            case "update",:  # TODO seems broken
+                out = _season_update_years(subject.api, db, *NULL_YEAR_RANGE)
+            case "update", (min_year, max_year), classification if isinstance(
+                classification, int | str
+            ):
+                target = _season_retrieve_metadata(
+                    db, (min_year, max_year), classification
+                )
+                out = _season_upload(
+                    subject.api,
+                    db,
+                    list2strray(classification.split()),
+                    target.start_date,
+                    target.stop_date,
+                    target.playlist_spotify_id,
+                )
+            case "update", str(classification):
+                target = _season_retrieve_metadata(
+                    db, NULL_YEAR_RANGE, classification
+                )
+                out = _season_upload(
+                    subject.api,
+                    db,
+                    list2strray(classification.split()),
+                    None,
+                    None,
+                    target.playlist_spotify_id,
+                )
+            case (min_year, max_year), int(season_num):
+                start_date = _season_calculate_start(db, min_year, season_num)
+                end_date = _season_calculate_end(db, start_date, max_year)
+                playlist_id = subject.mob["id"]
+                out = _season_create(
+                    subject.api,
+                    db,
+                    season_num,
+                    start_date,
+                    end_date,
+                    playlist_id,
+                )
+            case (min_year, max_year), str(classification):
+                start_date = beginning_year(min_year)
+                end_date = beginning_year(max_year + 1)
+                playlist_id = subject.mob["id"]
+                out = _season_create(
+                    subject.api,
+                    db,
+                    list2strray(classification.split()),
+                    start_date,
+                    end_date,
+                    playlist_id,
+                )
+            case str(classification),:
+                playlist_id = subject.mob["id"]
+                out = _season_create(
+                    subject.api,
+                    db,
+                    list2strray(classification.split()),
+                    None,
+                    None,
+                    playlist_id,
+                )
+            case _:
+                out = None
+                raise UnsupportedQueryError("season", query)
     return State(subject[0], out or subject[1], subject[2])
 
 
@@ -230,7 +330,7 @@ def ss_score(subject: State, query: Query) -> State:
         mob = ss_open(subject, query).mob
     else:
         mob = subject.mob
-    database = sql.connect(DB_LOCATION)
+    database = shared_database()
     match mob['type']:
         case 'artist':
             io_notify(overall_artist_score(database, mob['id'], None))
@@ -240,93 +340,90 @@ def ss_score(subject: State, query: Query) -> State:
                 io_notify(rows.fetchone()[0])
             except TypeError as err:
                 raise NoResultsError from err
-    database.close()
     return State(subject[0], mob, subject[2])
 
 
 def _classify_project(
-    api: Spotify, db: sql.Connection, proj: Mob, classification: str
+    api: Spotify,
+    db: sql.Connection,
+    proj: Mob,
+    classification: str,
+    album: Mob | None,
 ):
-    if proj["root_album"]["uri"] is None:
+    if album is None:
         return
-    row = _classify_build_row(api, db, classification, proj)
+    row = _classify_build_row(api, db, classification, proj, album)
     if classification in RANKINGS:
         row = _classify_rank(db, row)
-        target_table = "ranking"
+        insert_sql = _INSERT_RANKING_SQL
+    elif db.execute(
+        _INSERT_CERT_OR_IGNORE_SQL, _classify_encode_row(row)
+    ).rowcount:
+        # Nothing to merge with, which is the usual case
+        return
     else:
-        row = _classify_certify(api, db, row)
-        target_table = "certification"
+        row = _classify_certify(api, db, row, album)
+        insert_sql = _INSERT_CERT_SQL
     if not row:
         return
-    db.execute(
-        f"INSERT INTO {target_table} VALUES {sql_array(row)}",
-        (
-            *row[0:4],
-            *map(list2strray, (row[4], [d.seconds for d in row[5]], row[6])),
-            *row[7:10],
-            list2strray(row[10]),
-        ),
+    db.execute(insert_sql, _classify_encode_row(row))
+
+
+def _classify_encode_row(row) -> tuple:
+    return (
+        *row[0:4],
+        list2strray(row.track_names),
+        list2strray(row.track_durations_sec),
+        list2strray(row.track_numbers),
+        row.retrieved_time,
+        row.artist_group,
+        row.album_spotify_id,
+        list2strray(row.track_spotify_ids),
+        row.track_count,
+        row.project_value,
     )
 
 
 def _classify_rank(db, row):
-    columns = "release_day, artist_names, name, classification, track_names, track_durations_sec, track_numbers, retrieved_time, artist_group, album_spotify_id, track_spotify_ids"
-    existing_row = only(
-        read_rows(
-            db.execute(
-                f"""
-            SELECT {columns} FROM ranking
-            WHERE release_day = ? AND artist_names = ? AND name = ?
-            """,
-                row[0:3],
-            ),
-            columns,
-        )
-    )
+    existing_row = db.execute(_SELECT_RANKING_SQL, row[0:3]).fetchone()
+    if existing_row:
+        ex_album_id, ex_classification, ex_track_count = existing_row
     if (
         existing_row
-        and existing_row[9] == row[9]
-        and existing_row[3] != row[3]
-        and len(existing_row[5]) - len(row[5]) < 4
+        and ex_album_id == row.album_spotify_id
+        and ex_classification != row.classification
+        and ex_track_count - len(row.track_durations_sec) < 4
     ):
         # Existing album (Spotify) ID matches and different ranking
         # Also not removing a destructive # of songs
-        io_notify(f"*{row[2]}* by {row[1]} is being re-ranked")
-        db.execute(
-            """
-            DELETE FROM ranking
-            WHERE release_day = ? AND artist_names = ? AND name = ?
-            """,
-            row[0:3],
-        )
-    elif existing_row and existing_row[9] != row[9]:
+        # The new row replaces the old one when it is inserted, unless it
+        # turns out to be a single of a project ranked at least as high
+        io_notify(f"{_classify_describe(row)} is being re-ranked")
+        checked_row = _classify_single_check(db, row)
+        if not checked_row:
+            db.execute(
+                """
+                DELETE FROM ranking
+                WHERE release_day = ? AND artist_names = ? AND name = ?
+                """,
+                row[0:3],
+            )
+        return checked_row
+    elif existing_row and ex_album_id != row.album_spotify_id:
         # Album Spotify ID did not match
-        io_notify(f"*{row[2]}* by {row[1]} caused a conflict and was skipped")
+        io_notify(
+            f"{_classify_describe(row)} caused a conflict and was skipped"
+        )
         return
     elif existing_row:
         return
     return _classify_single_check(db, row)
 
 
-def _classify_certify(api, db, row):
-    columns = "release_day, artist_names, name, classification, track_names, track_durations_sec, track_numbers, retrieved_time, artist_group, album_spotify_id, track_spotify_ids"
-    existing_row = only(
-        read_rows(
-            db.execute(
-                f"""
-            SELECT {columns} FROM certification
-            WHERE release_day = ? AND artist_names = ? AND name = ?
-                AND classification = ?
-            """,
-                row[0:4],
-            ),
-            columns,
-        )
-    )
-    if existing_row and existing_row[9] == row[9]:
-        for column in range(4, 7):
-            existing_row[column].append(row[column])
-        all_track_ids = existing_row[10] + row[10]
+def _classify_certify(api, db, row, album):
+    existing_row = db.execute(_SELECT_CERT_SQL, row[0:4]).fetchone()
+    if existing_row and existing_row[0] == row.album_spotify_id:
+        all_track_ids = strray2list(existing_row[1]) + row.track_spotify_ids
         db.execute(
             """
             DELETE FROM certification
@@ -338,36 +435,53 @@ def _classify_certify(api, db, row):
         row = _classify_build_row(
             api,
             db,
-            row[3],
+            row.classification,
             Mob(
                 {
-                    "name": row[2],
-                    "root_album": {"uri": f"spotify:album:{row[9]}"},
+                    "name": row.name,
                     "objects": [{"id": id} for id in all_track_ids],
                 }
             ),
+            album,
         )
     elif existing_row:
-        io_notify(f"*{row[2]}* by {row[1]} caused a conflict and was skipped")
+        io_notify(
+            f"{_classify_describe(row)} caused a conflict and was skipped"
+        )
         return
     return row
 
 
 def _classify_single_check(db, row):
-    columns = "release_day, artist_names, name, classification, track_names, track_durations_sec"
-    existing_projects = read_rows(
-        db.execute(
-            f"""
-        SELECT {columns} FROM ranking INNER JOIN helper_artist_group
+    # Rows stay encoded except for the tracks being compared, since the
+    # rest is only written back to the database
+    existing_projects = db.execute(
+        """
+        SELECT release_day, artist_names, name, classification,
+            track_names, track_durations_sec
+        FROM ranking INNER JOIN helper_artist_group
             ON helper_artist_group.artist_group = ranking.artist_group
                 AND helper_artist_group.artist_spotify_id = ?
+        WHERE NOT (release_day = ? AND artist_names = ? AND name = ?)
+            -- Either side being a single needs a track name in common,
+            -- unless one side has no tracks at all
+            AND (
+                track_names = '[]' OR ? = '[]' OR EXISTS (
+                    SELECT 1 FROM json_each(track_names)
+                    WHERE value IN (SELECT value FROM json_each(?))
+                )
+            )
         """,
-            (strray2list(row[8])[0],),
+        (
+            strray2list(row.artist_group)[0],
+            *row[0:3],
+            *(list2strray(row.track_names),) * 2,
         ),
-        columns,
     )
-    new_classification = row[3]
-    new_names, new_durations = row[4:6]
+    new_classification = row.classification
+    new_names, new_durations = row.track_names, row.track_durations_sec
+    # Collected and written together once the existing rows are read
+    singles, deleted_singles = [], []
     for (
         ex_release,
         ex_artists,
@@ -376,48 +490,64 @@ def _classify_single_check(db, row):
         ex_names,
         ex_durations,
     ) in existing_projects:
+        ex_names = strray2list(ex_names)
+        ex_durations = strray2list(ex_durations)
         if _classify_is_single(
             ex_names, ex_durations, new_names, new_durations
         ):
             # Existing is single of new
-            if new_classification in RANKINGS and RANKINGS.index(
-                new_classification
-            ) >= RANKINGS.index(ex_classification):
-                _classify_delete_single(db, ex_release, ex_artists, ex_name)
+            if (
+                new_classification in RANKINGS
+                and RANKINGS_INDEX[new_classification]
+                >= RANKINGS_INDEX[ex_classification]
+            ):
+                deleted_singles.append((ex_release, ex_artists, ex_name))
                 continue
-            _classify_store_single(
-                db,
-                single_release_day=ex_release,
-                artist_names=list2strray(ex_artists),
-                single_name=ex_name,
-                album_release_day=row[0],
-                album_name=row[2],
-                single_track_names=ex_names,
-                album_track_names=new_names,
+            singles.append(
+                _classify_single_row(
+                    single_release_day=ex_release,
+                    artist_names=ex_artists,
+                    single_name=ex_name,
+                    album_release_day=row.release_day,
+                    album_name=row.name,
+                    single_track_names=ex_names,
+                    album_track_names=new_names,
+                )
             )
         elif _classify_is_single(
             new_names, new_durations, ex_names, ex_durations
         ):
             # New is single of existing
-            if new_classification in RANKINGS and RANKINGS.index(
-                ex_classification
-            ) >= RANKINGS.index(new_classification):
-                return
-            _classify_store_single(
-                db,
-                *row[:3],
-                album_release_day=ex_release,
-                album_name=ex_name,
-                single_track_names=new_names,
-                album_track_names=ex_names,
+            if (
+                new_classification in RANKINGS
+                and RANKINGS_INDEX[ex_classification]
+                >= RANKINGS_INDEX[new_classification]
+            ):
+                row = None
+                break
+            singles.append(
+                _classify_single_row(
+                    *row[:3],
+                    album_release_day=ex_release,
+                    album_name=ex_name,
+                    single_track_names=new_names,
+                    album_track_names=ex_names,
+                )
             )
         else:
             continue
+    db.executemany(_INSERT_SINGLE_SQL, singles)
+    db.executemany(
+        """
+        DELETE FROM ranking
+        WHERE release_day = ? AND artist_names = ? AND name = ?
+        """,
+        deleted_singles,
+    )
     return row
 
 
-def _classify_store_single(
-    database,
+def _classify_single_row(
     single_release_day: date,
     artist_names: str,
     single_name: str,
@@ -425,106 +555,74 @@ def _classify_store_single(
     album_name: str,
     single_track_names: list[str],
     album_track_names: list[str],
-):
-    database.execute(
-        f"INSERT INTO helper_single VALUES {sql_array(range(7))}",
-        (
-            single_release_day,
-            artist_names,
-            single_name,
-            album_release_day,
-            album_name,
-            list2strray(single_track_names),
-            list2strray(album_track_names),
-        ),
-    )
-
-
-def _classify_delete_single(database, release, artist_names, name):
-    database.execute(
-        "DELETE FROM ranking WHERE release_day = ? AND artist_names = ? AND name = ?",
-        (release, list2strray(artist_names), name),
+) -> tuple:
+    return (
+        single_release_day,
+        artist_names,
+        single_name,
+        album_release_day,
+        album_name,
+        list2strray(single_track_names),
+        list2strray(album_track_names),
     )
 
 
 def _classify_is_single(
     single_names: Sequence[str],
-    single_durations: Sequence[timedelta],
+    single_durations: Sequence[int],
     album_names: Sequence[str],
-    album_durations: Sequence[timedelta],
+    album_durations: Sequence[int],
 ) -> bool:
-    for name in single_names:
-        if (
-            name not in album_names
-            or abs(
-                (
-                    album_durations[album_names.index(name)].seconds
-                    - single_durations[single_names.index(name)].seconds
-                )
-            )
-            > 5
-        ):
-            break
-    else:
-        return True
-    return False
+    # Reversed so repeated names keep their first duration, as .index did
+    single = dict(zip(reversed(single_names), reversed(single_durations)))
+    if len(single) > len(album_names):
+        return False
+    album = dict(zip(reversed(album_names), reversed(album_durations)))
+    return all(
+        name in album and abs(album[name] - duration) <= 5
+        for name, duration in single.items()
+    )
 
 
 def _classify_build_row(
-    api: Spotify, db: sql.Connection, classification: str, project: Mob
-) -> tuple[
-    date,
-    str,
-    str,
-    str,
-    list[str],
-    list[timedelta],
-    list[int],
-    datetime,
-    str,
-    str,
-    list[str],
-]:
-    album = cast(Mob, api.album(project["root_album"]["uri"]))
+    api: Spotify,
+    db: sql.Connection,
+    classification: str,
+    project: Mob,
+    album: Mob,
+) -> _ClassifyRow:
     retrieved_time = datetime.now()
 
     try:
-        release_day = _classify_parse_release(
-            album["release_date"].split(SPOTIFY_DATE_DELIMITER)
-        )
+        release_day = _classify_parse_release(album["release_date"])
     except AttributeError as err:
         release_day = date.max  # Should not go in database
         raise UnexpectedResponseException from err
     artist_zip = sorted((a["name"], a["id"]) for a in album["artists"])
     artist_names, artist_group = map(list2strray, zip(*artist_zip))
-    _classify_store_artist_group(db, artist_group, artist_zip)
     name = cast(str, album["name"])
-    included_track_ids = [t["id"] for t in project["objects"]]
-    tracks = [
-        (
-            t["name"],
-            t["duration_ms"],
-            t["track_number"],
-            t["id"],
-        )
-        for t in results_generator(
-            cast(SpotifyPKCE, api.auth_manager), album["tracks"]
-        )
-        if t["id"] in included_track_ids
-    ]
+    included_track_ids = frozenset(t["id"] for t in project["objects"])
     track_names, track_durations_sec, track_numbers, track_spotify_ids = (
         [],
         [],
         [],
         [],
     )
-    for track in tracks:
-        track_names.append(str(track[0]))
-        track_durations_sec.append(timedelta(milliseconds=track[1]))
-        track_numbers.append(int(track[2]))
-        track_spotify_ids.append(str(track[3]))
+    remaining_tracks = len(included_track_ids)
+    for t in results_generator(
+        cast(SpotifyPKCE, api.auth_manager), album["tracks"]
+    ):
+        if t["id"] in included_track_ids:
+            track_names.append(str(t["name"]))
+            track_durations_sec.append(t["duration_ms"] // 1000)
+            track_numbers.append(int(t["track_number"]))
+            track_spotify_ids.append(str(t["id"]))
+            remaining_tracks -= 1
+            if not remaining_tracks:
+                # Later pages of the album would not be used
+                break
     album_spotify_id = cast(str, album["id"])
-    return (
+    return _ClassifyRow(
         release_day,
         artist_names,
         name,
@@ -536,42 +634,71 @@ def _classify_build_row(
         artist_group,
         album_spotify_id,
         track_spotify_ids,
+        len(track_spotify_ids),
+        project_value(track_durations_sec),
     )
 
 
+def _classify_fetch_album(api: Spotify, uri: str) -> Mob:
+    """Fetches an album, which is only kept for one classify call"""
+    return cast(Mob, api.album(uri))
+
+
+def _classify_describe(row) -> str:
+    return f"*{row.name}* by {', '.join(strray2list(row.artist_names))}"
+
+
 def _classify_parse_release(release_date):
     try:
-        match release_date:
-            case yr, mo, da:
-                release_day = date(int(yr), int(mo), int(da))
-            case yr, mo:
-                release_day = date(
-                    int(yr), int(mo), calendar.monthrange(int(yr), int(mo))[1]
-                )
-            case yr,:
-                release_day = end_year(int(yr))
-            case _:
-                raise UnexpectedResponseException
-    except (TypeError, ValueError) as err:
+        # Full dates are ISO 8601, so the usual case needs no splitting
+        return date.fromisoformat(release_date)
+    except (TypeError, ValueError):
+        pass
+    parts = release_date.split(SPOTIFY_DATE_DELIMITER, 2)
+    try:
+        if len(parts) == 3:
+            release_day = date(int(parts[0]), int(parts[1]), int(parts[2]))
+        elif len(parts) == 2:
+            yr, mo = int(parts[0]), int(parts[1])
+            if mo == 2 and yr % 4 == 0 and (yr % 100 != 0 or yr % 400 == 0):
+                release_day = date(yr, mo, 29)
+            else:
+                release_day = date(yr, mo, _MONTH_LAST_DAY[mo - 1])
+        else:
+            release_day = end_year(int(parts[0]))
+    except (IndexError, TypeError, ValueError) as err:
         raise UnexpectedResponseException from err
     return release_day
 
 
-def _classify_store_artist_group(
-    db: sql.Connection, artist_group: str, artists: Collection[tuple[str, str]]
+def _classify_store_artist_groups(
+    db: sql.Connection, albums: Iterable[Mob]
 ):
-    existing_rows = db.execute(
-        "SELECT artist_name, artist_spotify_id FROM helper_artist_group WHERE artist_group = ?",
-        (artist_group,),
-    ).fetchall()
-    if not existing_rows:
-        for artist in artists:
-            db.execute(
-                "INSERT INTO helper_artist_group VALUES (?, ?, ?)",
-                (artist_group, *artist),
-            )
-        return
-    assert set(existing_rows) == set(artists)
+    groups: dict[str, frozenset[tuple[str, str]]] = {}
+    for album in albums:
+        artist_zip = sorted((a["name"], a["id"]) for a in album["artists"])
+        artist_group = list2strray(id for _, id in artist_zip)
+        groups[artist_group] = frozenset(artist_zip)
+    existing_groups: dict[str, set[tuple[str, str]]] = {}
+    for artist_group, *artist in db.execute(
+        f"""
+        SELECT artist_group, artist_name, artist_spotify_id
+        FROM helper_artist_group WHERE artist_group IN {sql_array(groups)}
+        """,
+        tuple(groups),
+    ):
+        existing_groups.setdefault(artist_group, set()).add(tuple(artist))
+    for artist_group, artists in existing_groups.items():
+        assert artists == groups[artist_group]
+    db.executemany(
+        _INSERT_ARTIST_SQL,
+        [
+            (artist_group, name, sid)
+            for artist_group, artists in groups.items()
+            if artist_group not in existing_groups
+            for name, sid in artists
+        ],
+    )
 
 
 def _season_upload(
@@ -582,16 +709,25 @@ def _season_upload(
     stop_date: date | None,
     playlist_id: str,
 ) -> Mob:
-    for artist_group, release_day in _season_retrieve_rows(
-        db,
-        "{0}.artist_group, {0}.release_day",
-        classification,
-        start_date,
-        stop_date,
-        _season_verify_exclusions(classification)
-    ):
-        store_artist_group_score(db, artist_group, release_day)
-    season = _season_retrieve_tracks(db, classification, start_date, stop_date)
+    projects = list(
+        _season_retrieve_rows(
+            db,
+            "{0}.artist_group, {0}.release_day, {0}.artist_names, {0}.name, "
+            "{0}.track_spotify_ids",
+            classification,
+            start_date,
+            stop_date,
+            _season_verify_exclusions(classification),
+        )
+    )
+    scores = store_artist_group_scores(
+        db, ((artist_group, day) for artist_group, day, *_ in projects)
+    )
+    # Scores are only stored above, so the season is ordered here
+    projects.sort(
+        key=lambda p: (p[1], -scores[tuple(p[0]), p[1]], p[2], p[3])
+    )
+    season = flatten(project[4] for project in projects)
     return_value = _season_transmit_projects(api, playlist_id, season)
     db.commit()
     return return_value
@@ -621,12 +757,10 @@ def _season_ensure_autoseason(
     season_dates: tuple[date, date],
 ) -> Mob:
     try:
-        playlist = _season_retrieve_metadata(db, year_range, season_number)[
-            "playlist_spotify_id"
-        ]
-        return _season_upload(
-            api, db, season_number, *season_dates, cast(str, playlist)
-        )
+        playlist = _season_retrieve_metadata(
+            db, year_range, season_number
+        ).playlist_spotify_id
+        return _season_upload(api, db, season_number, *season_dates, playlist)
     except NoResultsError:  # Ensure no unintentional capture
         return _season_create(
             api,
@@ -658,20 +792,45 @@ def _season_update_years(
     max_year: int | None,
 ) -> Mob | None:
     last_playlist = None
-    # Loop constant:
     max_year = max_year or date.today().year
+    min_year = min_year or _season_retrieve_min_year(db)
+    year_lens = _season_retrieve_year_lens(db, min_year, max_year)
+    for target_min, target_max in _season_plan_years(
+        year_lens, min_year, max_year
+    ):
+        if target_min == target_max:
+            last_playlist = _season_update_year(api, db, target_min)
+        else:
+            last_playlist = _season_ensure_autoseason(
+                api,
+                db,
+                (target_min, target_max),
+                1,
+                (beginning_year(target_min), beginning_year(target_max + 1)),
+            )
+    return last_playlist
+
+
+def _season_plan_years(
+    year_lens: dict[int, int], min_year: int, max_year: int
+) -> Iterator[tuple[int, int]]:
+    """Groups years into ranges of about one autoseason each
+
+    Single years are always yielded, so they can be split into
+    numbered seasons. Ranges of several years are only yielded if they
+    contain any tracks.
+    """
     # Loop variables:
     total = 0
-    target_min = min_year or _season_retrieve_min_year(db)
-    target_max = target_min
+    target_min = target_max = min_year
     while target_max <= max_year:
         # Each run of the loop produces no more than one
-        # playlist. As a result, the loop may run more than
+        # range. As a result, the loop may run more than
         # once with a specific value of `target_max`, but it
         # will never be run with the same pair of
         # `(target_min, target_max)` values. This design choice
         # was made to ease debugging.
-        selected_len = _season_retrieve_year_len(db, target_max)
+        selected_len = year_lens.get(target_max, 0)
         total += selected_len
         if total >= IDEAL_AUTOSEASON_LENGTH or target_max == max_year:
             if (
@@ -682,48 +841,75 @@ def _season_update_years(
                 # the next year that could be included is long
                 # enough for its own season(s)
                 target_max -= 1
-            if target_min == target_max:
-                last_playlist = _season_update_year(api, db, target_min)
-            elif total:
-                last_playlist = _season_ensure_autoseason(
-                    api,
-                    db,
-                    (target_min, target_max),
-                    1,
-                    (
-                        beginning_year(target_min),
-                        beginning_year(target_max + 1),
-                    ),
-                )
+            if target_min == target_max or total:
+                yield target_min, target_max
             total = 0
             target_min = target_max = target_max + 1
         else:
             target_max += 1
-    return last_playlist
 
 
 def _season_calculate_end(
     db: sql.Connection, start_date: date, max_year: int
 ) -> date:
     """Calculates end date for an ~80 song autoseason"""
-    stop_date = stop_day_max = beginning_year(max_year + 1)
-    table = _season_retrieve_rows(
-        db,
-        "ranking.track_names, ranking.release_day",
+    stop_date = beginning_year(max_year + 1)
+    season_sql, parameters = _season_select(
+        f"{_SEASON_SPLIT_COLUMNS}, helper_artist_score.score",
         0,
         start_date,
         stop_date,
         EXCLUSION_CERTIFICATIONS,
     )
+    # Running totals are kept by SQLite, as `_season_split` would count
+    # them, so only the project that reaches the ideal length comes back
+    row = db.execute(
+        f"""
+        SELECT release_day, total, total - day_total FROM (
+            SELECT release_day,
+                SUM(track_count) OVER (
+                    ORDER BY release_day, score DESC ROWS UNBOUNDED PRECEDING
+                ) AS total,
+                SUM(track_count) OVER (
+                    PARTITION BY release_day
+                    ORDER BY score DESC ROWS UNBOUNDED PRECEDING
+                ) AS day_total
+            FROM ({season_sql})
+        )
+        WHERE total >= ?
+        ORDER BY total, release_day
+        LIMIT 1
+        """,
+        (*parameters, IDEAL_AUTOSEASON_LENGTH),
+    ).fetchone()
+    if row is None:
+        return stop_date
+    release_day, total_tracks, previous_tracks = row
+    release_day = date.fromisoformat(release_day)
+    # Adjust one day to minimize absolute deviation from ideal
+    if (
+        IDEAL_AUTOSEASON_LENGTH - previous_tracks
+        < total_tracks - IDEAL_AUTOSEASON_LENGTH
+    ):
+        return release_day
+    return release_day + timedelta(1)
+
+
+def _season_split(
+    table: Iterable[tuple[int, date]], stop_date: date
+) -> date:
+    """Finds the day ~80 songs into projects in release order
+
+    `stop_date` is returned if the projects run out first.
+    """
     total_tracks, day, day_tracks = 0, "", 0
-    for track_names, release_day in table:
-        project_tracks = len(track_names)
+    for project_tracks, release_day in table:
         total_tracks += project_tracks
         if release_day != day:
             day, day_tracks = release_day, project_tracks
         else:
             day_tracks += project_tracks
-        if total_tracks >= 80:
+        if total_tracks >= IDEAL_AUTOSEASON_LENGTH:
             # Adjust one day to minimize absolute deviation from ideal
             if (
                 IDEAL_AUTOSEASON_LENGTH - (total_tracks - day_tracks)
@@ -760,97 +946,103 @@ def _season_calculate_year(db: sql.Connection, year: int) -> Iterable[date]:
     `len` of return value should not exceed 1 if there are 0 projects in
     the selected year.
     """
-    if not _season_retrieve_year_len(db, year):
-        return []
-    season_divider = beginning_year(year)
+    year_start, year_end = beginning_year(year), beginning_year(year + 1)
+    # One query for the whole year; each season is a suffix of it
+    table = list(
+        _season_retrieve_rows(
+            db,
+            _SEASON_SPLIT_COLUMNS,
+            0,
+            year_start,
+            year_end,
+            EXCLUSION_CERTIFICATIONS,
+        )
+    )
+    if not table:
+        return
+    season_divider = year_start
     yield season_divider
-    while season_divider != beginning_year(year + 1):
-        season_divider = _season_calculate_end(db, season_divider, year)
+    while season_divider != year_end:
+        first = bisect_left(table, season_divider, key=itemgetter(1))
+        season_divider = _season_split(islice(table, first, None), year_end)
         yield season_divider
 
 
-def _season_parse_query(query: str) -> Iterator[SeasonQueryGroup]:
-    query_tokens = (_season_parse_token(t) for t in cast(str, query.split()))
-    for token in query_tokens:
+def _season_parse_query(query: str) -> list[SeasonQueryGroup]:
+    tokens = query.split()
+    groups: list[SeasonQueryGroup] = []
+    for i, raw_token in enumerate(tokens):
+        token = _season_parse_token(raw_token)
         if isinstance(token, str) and token not in SEASON_KEYWORDS:
-            try:
-                yield " ".join(
-                    prepend(token, cast(Iterator[str], query_tokens))
-                ).upper()
-            except TypeError as err:
-                raise UnsupportedQueryError("season", query) from err
-        else:
-            yield token
+            # Everything from the first classification on is one group
+            if not all(
+                isinstance(_season_parse_token(t), str)
+                for t in tokens[i + 1 :]
+            ):
+                raise UnsupportedQueryError("season", query)
+            groups.append(" ".join(tokens[i:]).upper())
+            break
+        groups.append(token)
+    return groups
 
 
 def _season_parse_token(token: str) -> SeasonQueryGroup:
-    match token.split("-"):
-        case min, max if len(max) == 2 and len(
-            min
-        ) == 4 and max.isdigit() and min.isdigit():
-            return (int(min), int(min[:2] + max))
-        case min, max if len(max) == 4 and len(
-            min
-        ) == 4 and max.isdigit() and min.isdigit():
-            return (int(min), int(max))
-        case yr, if yr.isdigit() and len(yr) == 4:
-            return cast(tuple[int, int], (int(yr),) * 2)
-        case num, if num.isdigit() and len(num) < 4:
-            return int(num)
-    return token
+    match = _SEASON_TOKEN_RE.fullmatch(token)
+    if match is None:
+        return token
+    min, max, num = match.group("min", "max", "num")
+    if num:
+        return int(num)
+    if max is None:
+        return cast(tuple[int, int], (int(min),) * 2)
+    if len(max) == 2:
+        return (int(min), int(min[:2] + max))
+    return (int(min), int(max))
 
 
 def _season_retrieve_metadata(
     db: sql.Connection, year_range: YearRange, classification: str | int
-) -> dict[str, int | str | date]:
+) -> _SeasonMeta:
     """Gets metadata for a single season from the database"""
-    columns = "min_year, max_year, classification, start_date, stop_date, playlist_spotify_id"
+    if isinstance(classification, str):
+        classification = list2strray(classification.split())
     min_check = "" if year_range[0] else "OR min_year IS NULL"
     max_check = "" if year_range[1] else "OR max_year IS NULL"
-    rows = read_rows(
-        db.execute(
-            f"""
-        SELECT {columns} FROM season
+    cursor = db.execute(
+        f"""
+        SELECT {_SEASON_META_COLUMNS} FROM season
         WHERE classification = ? 
             AND (min_year = ? {min_check})
             AND (max_year = ? {max_check})
         """,
-            (classification, *year_range),
-        ),
-        columns,
+        (classification, *year_range),
     )
-    try:
-        return {k: v for k, v in zip(columns.split(", "), next(rows))}
-    except StopIteration:
+    cursor.row_factory = _season_meta_row
+    metadata = cursor.fetchone()
+    if metadata is None:
         raise NoResultsError
+    return metadata
 
 
-def _season_retrieve_min_year(db: sql.Connection) -> int:
-    """Finds the earliest release year among ranked tracks"""
-    return date.fromisoformat(
-        db.execute(
-            "SELECT release_day FROM ranking ORDER BY release_day LIMIT 1"
-        ).fetchone()[0]
-    ).year
+def _season_meta_row(cursor: sql.Cursor, row: tuple) -> _SeasonMeta:
+    min_year, max_year, classification, start_date, stop_date, playlist = row
+    return _SeasonMeta(
+        min_year,
+        max_year,
+        classification,
+        start_date and date.fromisoformat(start_date),
+        stop_date and date.fromisoformat(stop_date),
+        playlist,
+    )
 
 
-def _season_retrieve_tracks(
-    db: sql.Connection,
-    classification: str | int,
-    start_date: date | None,
-    stop_date: date | None,
-) -> Iterator[str]:
-    return flatten(
-        cast(list[str], row[0])
-        for row in _season_retrieve_rows(
-            db,
-            "{0}.track_spotify_ids",
-            classification,
-            start_date,
-            stop_date,
-            _season_verify_exclusions(classification)
-        )
-    )
+def _season_retrieve_min_year(db: sql.Connection) -> int:
+    """Finds the earliest release year among ranked tracks"""
+    # MIN on the leading primary key column is a single index seek
+    (min_day,) = db.execute("SELECT MIN(release_day) FROM ranking").fetchone()
+    if min_day is None:
+        raise NoResultsError
+    return date.fromisoformat(min_day).year
 
 
 def _season_retrieve_rows(
@@ -871,6 +1063,26 @@ def _season_retrieve_rows(
     If a date is `None`, the datetime.MAXYEAR and datetime.MINYEAR will
     be used to bound the season.
     """
+    cursor = db.execute(
+        *_season_select(
+            columns,
+            classification,
+            start_date,
+            stop_date,
+            exclusion_certifications,
+        )
+    )
+    yield from read_rows(cursor, columns)
+
+
+def _season_select(
+    columns: str,
+    classification: str | int,
+    start_date: date | None,
+    stop_date: date | None,
+    exclusion_certifications: Collection[str] = (),
+) -> tuple[str, tuple]:
+    """Builds the query and parameters behind `_season_retrieve_rows`"""
     if isinstance(classification, int):
         classifications = AUTOSEASON_RANKINGS
         target_table = "ranking"
@@ -881,52 +1093,96 @@ def _season_retrieve_rows(
         else:
             target_table = "certification"
     start_date, stop_date = start_date or date.min, stop_date or date.max
-    cursor = db.execute(
-        f"""
-        SELECT DISTINCT {columns.replace(';', '').format(target_table)}
-        FROM {target_table} LEFT JOIN certification AS exclusion
-            ON {target_table}.release_day = exclusion.release_day
-                AND {target_table}.artist_names = exclusion.artist_names
-                AND {target_table}.name = exclusion.name
-                AND exclusion.classification
-                    IN {sql_array(exclusion_certifications)}
-            LEFT JOIN helper_artist_score
-            ON {target_table}.artist_group=helper_artist_score.artist_group
-                AND {target_table}.release_day=helper_artist_score.date_from
-            LEFT JOIN helper_single
-            ON helper_single.single_release_day = {target_table}.release_day
-                AND helper_single.artist_names = {target_table}.artist_names
-                AND helper_single.single_name = {target_table}.name
-                AND helper_single.album_track_names IN (
-                    SELECT {target_table}.track_names FROM {target_table}
-                    WHERE classification IN {sql_array(classifications)}
-                )
-        WHERE helper_single.album_track_names IS NULL
-            AND {target_table}.classification IN {sql_array(classifications)}
-            AND {target_table}.release_day >= ?
-            AND {target_table}.release_day < ?
-            AND exclusion.classification IS NULL
-        ORDER BY {target_table}.release_day ASC, helper_artist_score.score DESC
-        """,
+    return (
+        _season_sql(
+            columns,
+            target_table,
+            len(classifications),
+            len(exclusion_certifications),
+        ),
         (
-            *exclusion_certifications,
-            *classifications,
             *classifications,
             start_date,
             stop_date,
+            *classifications,
+            *exclusion_certifications,
         ),
     )
-    yield from read_rows(cursor, columns)
 
 
-def _season_retrieve_year_len(db: sql.Connection, year: int) -> int:
-    """Counts the tracks in a year eligible for autoseasons"""
-    return len(
-        set(
-            _season_retrieve_tracks(
-                db, 0, beginning_year(year), beginning_year(year + 1)
+@lru_cache(maxsize=32)
+def _season_sql(
+    columns: str,
+    target_table: str,
+    classification_count: int,
+    exclusion_count: int,
+) -> str:
+    """Writes the query of `_season_select`, once per shape"""
+    # The joins match at most one row each, so only a project certified
+    # more than one of the requested ways can come back twice
+    distinct = (
+        "DISTINCT"
+        if target_table == "certification" and classification_count > 1
+        else ""
+    )
+    classification_array = sql_array(range(classification_count))
+    return f"""
+    SELECT {distinct} {columns.replace(';', '').format(target_table)}
+    FROM (
+        -- Narrowed before the joins, keeping the name for `columns`
+        SELECT * FROM {target_table}
+        WHERE classification IN {classification_array}
+            AND release_day >= ? AND release_day < ?
+    ) AS {target_table}
+        LEFT JOIN helper_artist_score
+        ON {target_table}.artist_group=helper_artist_score.artist_group
+            AND {target_table}.release_day=helper_artist_score.date_from
+        LEFT JOIN helper_single
+        ON helper_single.single_release_day = {target_table}.release_day
+            AND helper_single.artist_names = {target_table}.artist_names
+            AND helper_single.single_name = {target_table}.name
+            AND helper_single.album_track_names IN (
+                SELECT {target_table}.track_names FROM {target_table}
+                WHERE classification IN {classification_array}
             )
+    WHERE helper_single.album_track_names IS NULL
+        AND NOT EXISTS (
+            SELECT 1 FROM certification AS exclusion
+            WHERE exclusion.release_day = {target_table}.release_day
+                AND exclusion.artist_names = {target_table}.artist_names
+                AND exclusion.name = {target_table}.name
+                AND exclusion.classification
+                    IN {sql_array(range(exclusion_count))}
         )
+    ORDER BY {target_table}.release_day ASC, helper_artist_score.score DESC
+    """
+
+
+def _season_retrieve_year_lens(
+    db: sql.Connection, min_year: int, max_year: int
+) -> dict[int, int]:
+    """Counts the tracks eligible for autoseasons in each year of a range
+
+    Years without any eligible tracks are left out.
+    """
+    season_sql, parameters = _season_select(
+        "{0}.release_day, {0}.track_spotify_ids",
+        0,
+        beginning_year(min_year),
+        beginning_year(max_year + 1),
+        EXCLUSION_CERTIFICATIONS,
+    )
+    return dict(
+        db.execute(
+            f"""
+        SELECT CAST(strftime('%Y', season.release_day) AS INTEGER),
+            COUNT(DISTINCT track.value)
+        FROM ({season_sql}) AS season,
+            json_each(season.track_spotify_ids) AS track
+        GROUP BY 1
+        """,
+            parameters,
+        ).fetchall()
     )
 
 
@@ -963,15 +1219,16 @@ def _season_transmit_projects(
     spotify: Spotify, playlist_id: str, season: Iterable[str]
 ) -> Mob:
     """Uploads a season's tracks to a Spotify playlist"""
-    try:
-        season = prepend(next(iter(season)), season)
-    except StopIteration:
+    tracks = list(season)
+    if not tracks:
         raise NoResultsError
-    mob = cast(Mob, spotify.playlist(playlist_id))
-    ss_remove(State(spotify, mob), mob)
-    for song_chunk in chunked(season, 100):
-        spotify.playlist_add_items(playlist_id, song_chunk)
+    # Replacing clears the old contents in the same request
+    spotify.playlist_replace_items(playlist_id, tracks[:100])
+    for i in range(100, len(tracks), 100):
+        spotify.playlist_add_items(playlist_id, tracks[i : i + 100])
     return cast(Mob, spotify.playlist(playlist_id))
 
 def _season_verify_exclusions(classification: int | str):
-    return EXCLUSION_CERTIFICATIONS - set(strray2list(str(classification)))
+    if isinstance(classification, int):
+        return EXCLUSION_CERTIFICATIONS
+    return EXCLUSION_CERTIFICATIONS - set(strray2list(classification))
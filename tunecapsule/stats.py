@@ -3,10 +3,10 @@
 Copyright (c) 2021 IdmFoundInHim, under MIT License
 """
 import sqlite3 as sql
-from datetime import date, timedelta
-from collections.abc import Iterable
+from datetime import date
+from collections.abc import Iterable, Sequence
 
-from .utilities import list2strray, read_rows, sql_array
+from .utilities import list2strray, sql_array
 
 __all__ = ["cumulative_artist_score", "snapshot_artist_score"]
 
@@ -16,12 +16,13 @@ RANK_VALUE = {
     "B": 1.0,
     "C": 0.2,
 }
+# Called with a certified project's stored value and its track count
 CERT_VALUE = {
-    "collect": lambda tracks: _c_score_standard_certification_value(
-        75.0, "A", tracks
+    "collect": lambda value, track_count: (
+        _c_score_standard_certification_value(75.0, "A", value)
     ),
-    "masterpiece": lambda tracks: len(tracks) * 10,
-    "repeat1": lambda tracks: len(tracks) * 4.2,
+    "masterpiece": lambda value, track_count: track_count * 10,
+    "repeat1": lambda value, track_count: track_count * 4.2,
 }
 
 
@@ -31,7 +32,7 @@ def cumulative_artist_score(
     """Represents the volume of quality music for an artist
 
     The constants not related to classifications have been implemented
-    as magic numbers in `_cumulative_artist_score_project_value`.
+    as magic numbers in `project_value`.
 
     The "Street Cred" Score (v1.0)
     -----------------------
@@ -40,72 +41,61 @@ def cumulative_artist_score(
     All other projects are considered albums and will be scored at the calculated value times the ranking point value (1.8, 1.0, or 0.2). Albums recieve a base value plus up to two length bonuses. The base value is the duration of the album divided by the general average duration of a song, fixed at 3 min 30 sec. All albums below 63 minutes (but at least 15 minutes) recieve a 1 point value bonus, and all albums at least 30 minutes recieve a seperate 1 point value bonus. In other words, albums from 30 minutes to below 63 minutes recieve two bonus value points, while all other albums recieve one bonus value point.
     """
     simulated_date = simulated_date or date.today()
-    columns = "classification, track_durations_sec"
-    rankings = read_rows(
-        db.execute(
-            f"""
-        SELECT {columns} FROM ranking JOIN helper_artist_group
+    # Project values are stored on classification, so SQLite can total
+    # them per ranking; certifications are valued one by one
+    projects = db.execute(
+        f"""
+        SELECT 'ranking', classification, SUM(project_value), NULL
+        FROM ranking JOIN helper_artist_group
             ON ranking.artist_group = helper_artist_group.artist_group
                 AND helper_artist_group.artist_spotify_id = ?
         WHERE ranking.release_day <= ?
-        """,
-            (spotify_artist_id, simulated_date),
-        ),
-        columns,
-    )
-    ranking_score = sum(
-        RANK_VALUE.get(classification, 0.0) * _c_score_project_value(track_durations)
-        for classification, track_durations in rankings
-    )
-    certifications = read_rows(
-        db.execute(
-            f"""
-        SELECT {columns} FROM certification JOIN helper_artist_group
+        GROUP BY classification
+        UNION ALL
+        SELECT 'certification', classification, project_value, track_count
+        FROM certification JOIN helper_artist_group
             ON certification.artist_group = helper_artist_group.artist_group
             AND helper_artist_group.artist_spotify_id = ?
         WHERE classification IN {sql_array(CERT_VALUE)}
             AND certification.release_day <= ?
         """,
-            (spotify_artist_id, *list(CERT_VALUE), simulated_date),
-        ),
-        columns,
-    )
-    return sum(
         (
-            CERT_VALUE[classification](track_rankings)
-            for classification, track_rankings in certifications
+            spotify_artist_id,
+            simulated_date,
+            spotify_artist_id,
+            *list(CERT_VALUE),
+            simulated_date,
         ),
-        ranking_score,
     )
+    score = 0.0
+    for table, classification, value, track_count in projects:
+        if table == "ranking":
+            score += RANK_VALUE.get(classification, 0.0) * value
+        else:
+            score += CERT_VALUE[classification](value, track_count)
+    return score
 
 
-def _c_score_project_value(
-    track_durations_seconds: Iterable[timedelta],
-) -> int | float:
-    track_durations = set(track_durations_seconds)
-    project_length = len(track_durations)
-    project_duration_seconds = sum(track_durations, timedelta(0))
-    if project_length < 5 and project_duration_seconds < timedelta(minutes=15):
+def project_value(track_durations_seconds: Sequence[int]) -> int | float:
+    """Values a project by length, before its classification is applied
+
+    Takes the duration of each track in whole seconds. Tracks of equal
+    length all count.
+    """
+    project_length = len(track_durations_seconds)
+    project_duration_seconds = sum(track_durations_seconds)
+    if project_length < 5 and project_duration_seconds < 15 * 60:
         return project_length
     else:
-        bonus = (
-            2
-            if timedelta(minutes=15)
-            <= project_duration_seconds
-            < timedelta(minutes=63)
-            else 1
-        )
-        return (
-            project_duration_seconds / timedelta(minutes=3, seconds=30) + bonus
-        )
+        bonus = 2 if 15 * 60 <= project_duration_seconds < 63 * 60 else 1
+        # An average song is fixed at 3 min 30 sec
+        return project_duration_seconds / 210 + bonus
 
 
 def _c_score_standard_certification_value(
-    standard_value: int | float, ranking: str, tracks: Iterable[timedelta]
+    standard_value: int | float, ranking: str, value: int | float
 ) -> float:
-    return abs(
-        standard_value - RANK_VALUE.get(ranking, 0.0) * _c_score_project_value(tracks)
-    )
+    return abs(standard_value - RANK_VALUE.get(ranking, 0.0) * value)
 
 
 def snapshot_artist_score(
@@ -129,34 +119,39 @@ def snapshot_artist_score(
     ----------------------
     """
     simulated_date = simulated_date or date.today()
-    columns = "classification, track_durations_sec"
-    table = read_rows(
-        db.execute(
-            f"""
-        SELECT {columns} FROM ranking JOIN helper_artist_group
-            ON ranking.artist_group = helper_artist_group.artist_group
-                AND helper_artist_group.artist_spotify_id = ?
-        WHERE ranking.release_day <= ?
-        ORDER BY ranking.release_day DESC
-        """,
-            (spotify_artist_id, simulated_date),
-        ),
-        columns,
-    )
-    durations = {"A": timedelta(0), "B": timedelta(0)}
-    project_duration_seconds = durations.copy()
-    for classification, track_durations_seconds in table:
-        if classification not in durations:
-            break
-        project_duration_seconds[classification] += sum(
-            track_durations_seconds, timedelta(0)
+    # Only projects newer than the latest C or E can be in range, and
+    # SQLite keeps running totals of playtime back from the newest one
+    (score_seconds,) = db.execute(
+        """
+        WITH project AS (
+            SELECT ranking.classification, ranking.release_day,
+                COALESCE(
+                    (SELECT SUM(value) FROM json_each(track_durations_sec)),
+                    0
+                ) AS seconds
+            FROM ranking JOIN helper_artist_group
+                ON ranking.artist_group = helper_artist_group.artist_group
+                    AND helper_artist_group.artist_spotify_id = ?
+            WHERE ranking.release_day <= ?
+        ), recent AS (
+            SELECT SUM(seconds) OVER newest_first AS total,
+                SUM(IIF(classification = 'A', seconds, 0))
+                    OVER newest_first AS total_a
+            FROM project
+            WHERE release_day > (
+                SELECT COALESCE(MAX(release_day), '') FROM project
+                WHERE classification NOT IN ('A', 'B')
+            )
+            WINDOW newest_first AS (
+                ORDER BY release_day DESC ROWS UNBOUNDED PRECEDING
+            )
         )
-        seconds_a = durations["A"] + project_duration_seconds["A"]
-        seconds_b = durations["B"] + project_duration_seconds["B"]
-        if seconds_a / (seconds_a + seconds_b) > 0.7:
-            durations = {"A": seconds_a, "B": seconds_b}
-            project_duration_seconds = {"A": timedelta(0), "B": timedelta(0)}
-    return (durations["A"] + durations["B"]) / timedelta(minutes=1)
+        SELECT COALESCE(MAX(total), 0) FROM recent
+        WHERE CAST(total_a AS REAL) / total > 0.7
+        """,
+        (spotify_artist_id, simulated_date),
+    ).fetchone()
+    return score_seconds / 60
 
 
 def overall_artist_score(
@@ -169,25 +164,37 @@ def overall_artist_score(
     ) + snapshot_artist_score(db, spotify_artist_id, simulated_date)
 
 
-def store_artist_group_score(
+def store_artist_group_scores(
     db: sql.Connection,
-    artist_group: Iterable[str],
-    simulated_date: date | None,
-):
-    """Stores score entries for an artist group and constituent artists
-
-    Does not commit changes
+    artist_groups: Iterable[tuple[Sequence[str], date | None]],
+) -> dict[tuple[tuple[str, ...], date], float]:
+    """Stores score entries for artist groups and constituent artists
+
+    Takes pairs of an artist group and the date it is scored on, and
+    writes every entry with one statement. Does not commit changes.
+    Returns the score of each group, keyed by the group (as a tuple)
+    and date.
     """
-    group_score = 0.0
-    simulated_date = simulated_date or date.today()
-    for artist in artist_group:
-        score = overall_artist_score(db, artist, simulated_date)
-        db.execute(
-            "INSERT INTO helper_artist_score VALUES (?, ?, ?)",
-            (artist, simulated_date, score),
+    artist_scores: dict[tuple[str, date], float] = {}
+    group_scores: dict[tuple[tuple[str, ...], date], float] = {}
+    entries = []
+    for artist_group, simulated_date in artist_groups:
+        simulated_date = simulated_date or date.today()
+        key = (tuple(artist_group), simulated_date)
+        if key in group_scores:
+            continue
+        group_score = 0.0
+        for artist in artist_group:
+            if (artist, simulated_date) not in artist_scores:
+                score = overall_artist_score(db, artist, simulated_date)
+                artist_scores[artist, simulated_date] = score
+                entries.append((artist, simulated_date, score))
+            group_score = max(
+                group_score, artist_scores[artist, simulated_date]
+            )
+        entries.append(
+            (list2strray(artist_group), simulated_date, group_score)
         )
-        group_score = max(group_score, score)
-    db.execute(
-        "INSERT INTO helper_artist_score VALUES (?, ?, ?)",
-        (list2strray(artist_group), simulated_date, group_score),
-    )
+        group_scores[key] = group_score
+    db.executemany("INSERT INTO helper_artist_score VALUES (?, ?, ?)", entries)
+    return group_scores
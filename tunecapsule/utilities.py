@@ -3,40 +3,40 @@
 Copyright (c) 2021 IdmFoundInHim, under MIT License
 """
 from collections.abc import Callable, Collection, Iterable, Iterator
-from datetime import date, datetime, timedelta
+from datetime import date, datetime
+from functools import cache
+import json
 import sqlite3
 from typing import cast
 
-from ._constants import DB_STRRAY_DELIMITER
-
 
 def _identity(x):
     return x
 
 
 def strray2list(strray: str) -> list:
-    return strray.split(DB_STRRAY_DELIMITER)
+    """Decodes an array column, stored as JSON so SQLite can read it"""
+    return json.loads(strray)
 
 
 def list2strray(lst: Iterable) -> str:
-    return DB_STRRAY_DELIMITER.join(map(str, lst))
+    return json.dumps(list(lst), ensure_ascii=False, separators=(",", ":"))
 
 
 DB_COLUMNS: dict[str, Callable] = {
-    "sha256": bytes,
     "release_day": date.fromisoformat,
     "artist_names": strray2list,
     "name": str,
     "classification": str,
     "track_names": strray2list,
-    "track_durations_sec": lambda s: [
-        timedelta(seconds=int(n)) for n in strray2list(s)
-    ],
-    "track_numbers": lambda s: [int(n) for n in strray2list(s)],
+    "track_durations_sec": strray2list,
+    "track_numbers": strray2list,
     "retrieved_time": datetime.fromisoformat,
     "artist_group": strray2list,
     "album_spotify_id": str,
     "track_spotify_ids": strray2list,
+    "track_count": int,
+    "project_value": float,
     "min_year": int,
     "max_year": int,
     "start_date": date.fromisoformat,
@@ -47,19 +47,31 @@ DB_COLUMNS: dict[str, Callable] = {
 }
 
 
-def read_rows(cursor: sqlite3.Cursor, columns: str) -> Iterator[tuple]:
-    parsers = [
+@cache
+def _row_factory(columns: str) -> Callable[[sqlite3.Cursor, tuple], tuple]:
+    parsers = tuple(
         # Matches SQL format for column names, ignoring table names
         DB_COLUMNS[name.strip().split(".")[-1]]
         for name in columns.split(",")
-    ]
-    for row in iter(cursor.fetchone, None):
-        yield tuple(
-            parser(column) if column else None
-            for column, parser in zip(row, parsers)
-        )
+    )
+
+    def parse_row(cursor: sqlite3.Cursor, row: tuple) -> tuple:
+        return tuple(map(_parse_column, parsers, row))
+
+    return parse_row
+
+
+def _parse_column(parser: Callable, column):
+    return None if column is None else parser(column)
+
+
+def read_rows(cursor: sqlite3.Cursor, columns: str) -> Iterator[tuple]:
+    # Rows are parsed by the cursor as they are fetched
+    cursor.row_factory = _row_factory(columns)
+    return cursor
 
 
+@cache
 def beginning_year(year: int):
     return date(year, 1, 1)
 